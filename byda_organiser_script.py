@@ -21,6 +21,8 @@ import pystray
 from PIL import Image
 import threading
 import requests
+import contextlib
+import json
 
 # Retrieve the directory where the Python script is located
 script_dir = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
@@ -34,6 +36,133 @@ icon_path = os.path.join(script_dir, "foreman_software_solutions_logo.ico")
 # Create a global variable to track the status of the system tray icon
 system_tray_icon_status = False
 
+# Specify the rolling trace file and latency summary file names, stored alongside the configuration file
+trace_file_path = "byda_trace.json"
+latency_summary_file_path = "byda_latency_summary.jsonl"
+
+# Cap the number of trace events kept in the rolling trace file (older events are discarded first)
+trace_file_event_limit = 100000
+
+# Create global variables to collect the trace spans and per-job latency records for each processing pass
+trace_events = []
+trace_job_records = {}
+trace_lock = threading.Lock()
+trace_start_time = time.perf_counter()
+trace_start_wall_time = time.time()
+
+
+# Retrieve (or create) the latency record for the specified job number
+def retrieve_trace_job_record(job_number):
+    return trace_job_records.setdefault(job_number, {
+        "stages": {},
+        "providers": {},
+        "slowest_io": None,
+        "earliest_arrival": None,
+        "latest_landing": None,
+    })
+
+
+# Retrieve (or create) the per-provider latency record within the specified job record
+def retrieve_trace_provider_record(job_record, provider_name):
+    return job_record["providers"].setdefault(provider_name, {
+        "io_seconds": 0.0, "files": 0, "bytes": 0, "max_arrival_to_landing_seconds": None})
+
+
+# Retrieve the size of a saved file, returning 0 if it cannot be accessed so tracing never interrupts processing
+def retrieve_file_size(file_location):
+    try:
+        return os.path.getsize(file_location)
+
+    except OSError:
+        return 0
+
+
+# Record a trace span around a processing stage or I/O operation in Chrome trace-event format
+# The yielded dictionary can be updated by the caller to attach extra details (e.g. file sizes) to the span
+@contextlib.contextmanager
+def trace_span(name, job_number=None, category="stage", **span_arguments):
+    span_start_time = time.perf_counter()
+    try:
+        yield span_arguments
+    finally:
+        span_duration = time.perf_counter() - span_start_time
+        if job_number is not None:
+            span_arguments["job_number"] = job_number
+
+        # Format the span as a Chrome trace-event 'complete' event with microsecond wall-clock timestamps
+        # so spans from separate program runs do not overlap within the rolling trace file
+        trace_event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((trace_start_wall_time + span_start_time - trace_start_time) * 1000000),
+            "dur": round(span_duration * 1000000),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            # Share the span_arguments dictionary so details added after the span closes (e.g. file sizes) are kept
+            "args": span_arguments,
+        }
+
+        with trace_lock:
+            trace_events.append(trace_event)
+
+            # Add the span duration to the per-job latency record
+            if job_number is not None:
+                job_record = retrieve_trace_job_record(job_number)
+                if category == "stage":
+                    job_record["stages"][name] = job_record["stages"].get(name, 0.0) + span_duration
+                elif category == "io":
+                    provider_name = span_arguments.get("provider", "Unknown Provider")
+                    provider_record = retrieve_trace_provider_record(job_record, provider_name)
+                    provider_record["io_seconds"] += span_duration
+
+                    # Keep track of the slowest individual file operation within the job
+                    if job_record["slowest_io"] is None or span_duration > job_record["slowest_io"]["seconds"]:
+                        job_record["slowest_io"] = {"name": name, "seconds": span_duration,
+                                                    "provider": provider_name,
+                                                    "file": str(span_arguments.get("file", ""))}
+
+
+# Record a saved file against its provider and the time from provider email arrival to file landing
+# Files that had already landed during a previous processing pass are not counted as a new landing
+def trace_file_landing(job_number, email, provider_name, file_size, file_previously_landed):
+    # Count every saved file and its size, regardless of whether it is a new landing
+    with trace_lock:
+        job_record = retrieve_trace_job_record(job_number)
+        provider_record = retrieve_trace_provider_record(job_record, provider_name)
+        provider_record["files"] += 1
+        provider_record["bytes"] += file_size
+
+    if file_previously_landed:
+        return
+
+    try:
+        # Outlook returns the machine's local wall-clock time labelled as UTC, so read both times in local time
+        landing_time = datetime.datetime.now().astimezone()
+        arrival_time = email.ReceivedTime.replace(tzinfo=None).astimezone()
+        arrival_to_landing = (landing_time - arrival_time).total_seconds()
+
+    except (AttributeError, TypeError, ValueError, OverflowError):
+        print(f"Warning: Unable to Determine Arrival Time for Job {job_number} ({provider_name}).")
+        return
+
+    # Exclude negative latencies from the summary, as they indicate a clock difference with the mail server
+    if arrival_to_landing < 0:
+        print(f"Warning: Job {job_number} ({provider_name}) Arrival Time is {-arrival_to_landing:.0f} Seconds "
+              f"After Its Landing Time. Excluding From Latency Summary.")
+        return
+
+    with trace_lock:
+        if (provider_record["max_arrival_to_landing_seconds"] is None
+                or arrival_to_landing > provider_record["max_arrival_to_landing_seconds"]):
+            provider_record["max_arrival_to_landing_seconds"] = arrival_to_landing
+
+        # Track the first email arrival and the last file landing for the job's end-to-end latency
+        if job_record["earliest_arrival"] is None or arrival_time < job_record["earliest_arrival"]:
+            job_record["earliest_arrival"] = arrival_time
+        if job_record["latest_landing"] is None or landing_time > job_record["latest_landing"]:
+            job_record["latest_landing"] = landing_time
+
 
 # Check if the user's OS has an active internet connection
 def check_internet_connection():
@@ -196,16 +325,18 @@ def retrieve_job_information(inbox, processed_jobs, target_directory):
     print(f"Retrieving Job Information...")
 
     # Iterate over the email messages within the user-selected Microsoft Outlook folder
-    for email in inbox.Items:
-        # Match the email message files to the relevant criteria and check if it has been received within the
-        # scanning_time_criteria timeframe
-        if email.SenderName.lower() == "dbyd@1100.com.au" and email.ReceivedTime >= scanning_time_criteria:
-            # Extract job numbers from the email message subject lines using the specified criteria
-            subject_criteria = email.Subject.lower()
-            message_job_number = re.findall(r'\b\d{8}\b', subject_criteria)
-            # If any 8-digit numbers are found in the subject line, add them to the job_numbers list
-            job_numbers.extend(message_job_number)
-            print(f"Job {message_job_number} Information Identified.")
+    with trace_span("Scan Inbox", category="io") as span_arguments:
+        for email in inbox.Items:
+            # Match the email message files to the relevant criteria and check if it has been received within the
+            # scanning_time_criteria timeframe
+            if email.SenderName.lower() == "dbyd@1100.com.au" and email.ReceivedTime >= scanning_time_criteria:
+                # Extract job numbers from the email message subject lines using the specified criteria
+                subject_criteria = email.Subject.lower()
+                message_job_number = re.findall(r'\b\d{8}\b', subject_criteria)
+                # If any 8-digit numbers are found in the subject line, add them to the job_numbers list
+                job_numbers.extend(message_job_number)
+                print(f"Job {message_job_number} Information Identified.")
+        span_arguments["job_count"] = len(job_numbers)
 
     # Do not remove contents of target directory if job_number is part of processed_jobs set in config file
     for job_number in job_numbers:
@@ -264,6 +395,26 @@ def initialize_byda_job(job_number, target_directory, scanning_time_criteria, in
     return byda_job_location
 
 
+# Determine the provider name (and provider subdirectory name) from the sender of a provider email message
+def retrieve_provider_name(email):
+    provider_name = str(email.SenderName.replace("BYDA -", "").strip() or "Unknown Provider")
+
+    # Check if the sender's email address matches the specific address
+    if provider_name == "dbyd.JENreplyTA@jemena.com.au":
+        provider_name = "Jemena Electricity Networks (VIC)"
+
+    return provider_name
+
+
+# Determine the provider name for tracing, falling back to 'Unknown Provider' so tracing never prevents a file save
+def retrieve_trace_provider_name(email):
+    try:
+        return retrieve_provider_name(email)
+
+    except AttributeError:
+        return "Unknown Provider"
+
+
 # Make a copy of the provider email message files and move them into the 'E-Mail Files' subdirectory
 def copy_message_files(job_number, byda_job_location, outlook, scanning_time_criteria, inbox):
     # Initialize module variable
@@ -280,10 +431,22 @@ def copy_message_files(job_number, byda_job_location, outlook, scanning_time_cri
                                                        + '.msg'))
                 provider_message_location = Path(byda_job_location / "E-Mail Files".strip())
                 provider_message_location.mkdir(parents=True, exist_ok=True)
+                provider_message_path = provider_message_location / provider_message_filename
+
+                # Determine the tracing details in a non-fatal step so they can never prevent the file save
+                provider_name = retrieve_trace_provider_name(email)
+                file_previously_landed = os.path.exists(provider_message_path)
                 try:
                     # Save the email message files to the predetermined destination
-                    provider_message_file = outlook.Session.GetItemFromID(email.EntryID)
-                    provider_message_file.SaveAs(str(provider_message_location / provider_message_filename))
+                    with trace_span("SaveAs", job_number, category="io", provider=provider_name,
+                                    file=provider_message_filename) as span_arguments:
+                        provider_message_file = outlook.Session.GetItemFromID(email.EntryID)
+                        provider_message_file.SaveAs(str(provider_message_path))
+
+                    # Record the file size after the span closes so it is not counted as save time
+                    span_arguments["bytes"] = retrieve_file_size(provider_message_path)
+                    trace_file_landing(job_number, email, provider_name, span_arguments["bytes"],
+                                       file_previously_landed)
 
                 except AttributeError:
                     print(f"Warning: Failed to Save Message File {provider_message_filename}.")
@@ -310,11 +473,7 @@ def extract_message_files(job_number, byda_job_location, scanning_time_criteria,
             # Check if the job number being processed matches the criteria outlined below
             if str(job_number) in email.Subject.lower() and email.ReceivedTime >= scanning_time_criteria:
                 # Determine the provider subdirectory name given the specified criteria
-                provider_name = str(email.SenderName.replace("BYDA -", "").strip() or "Unknown Provider")
-
-                # Check if the sender's email address matches the specific address
-                if provider_name == "dbyd.JENreplyTA@jemena.com.au":
-                    provider_name = "Jemena Electricity Networks (VIC)"
+                provider_name = retrieve_provider_name(email)
 
                 # Flag the kdr_indicator as True if the specific provider name is identified
                 if provider_name == "KDR Victoria Pty Ltd":
@@ -327,7 +486,15 @@ def extract_message_files(job_number, byda_job_location, scanning_time_criteria,
                     for attachment in email.Attachments:
                         attachment_filename = str(re.sub(invalid_filename_characters, '', attachment.FileName))
                         attachment_location = os.path.join(provider_location, attachment_filename.strip())
-                        attachment.SaveAsFile(attachment_location)
+                        file_previously_landed = os.path.exists(attachment_location)
+                        with trace_span("SaveAsFile", job_number, category="io", provider=provider_name,
+                                        file=attachment_filename) as span_arguments:
+                            attachment.SaveAsFile(attachment_location)
+
+                        # Record the file size after the span closes so it is not counted as save time
+                        span_arguments["bytes"] = retrieve_file_size(attachment_location)
+                        trace_file_landing(job_number, email, provider_name, span_arguments["bytes"],
+                                           file_previously_landed)
 
                 except AttributeError:
                     print(f"Warning: Failed to Extract {provider_name} Message Attachments.")
@@ -356,7 +523,9 @@ def initialize_coversheet(job_number, byda_job_location):
     if os.path.isfile(coversheet_location):
         try:
             # Rename the coversheet file and move it to the BYDA job location directory
-            shutil.move(coversheet_location, os.path.join(byda_job_location, coversheet_filename))
+            with trace_span("Move Coversheet", job_number, category="io", provider="dbyd@1100.com.au",
+                            file=coversheet_filename, bytes=retrieve_file_size(coversheet_location)):
+                shutil.move(coversheet_location, os.path.join(byda_job_location, coversheet_filename))
             # Remove the subdirectory where the coversheet file was originally located
             shutil.rmtree(os.path.join(byda_job_location, "dbyd@1100.com.au").strip())
 
@@ -390,8 +559,10 @@ def scan_coversheet(job_number, byda_job_location):
             text_interpreter = PDFPageInterpreter(coversheet_manager, text_converter)
 
             # Iterate over all the pages within the coversheet file
-            for page in PDFPage.get_pages(pdf_file):
-                text_interpreter.process_page(page)
+            for page_number, page in enumerate(PDFPage.get_pages(pdf_file), start=1):
+                with trace_span("Parse Coversheet Page", job_number, category="parse",
+                                file=f"Job {job_number} - Cover Sheet.pdf", page=page_number):
+                    text_interpreter.process_page(page)
                 coversheet_extracted_text += coversheet_string.getvalue()
 
             # Define search scope parameters for the scanning process to identify the specific provider details
@@ -563,6 +734,83 @@ def update_config_file(job_number, byda_job_complete):
         return
 
 
+# Export the collected trace spans in Chrome trace-event format and append the per-job latency summaries
+def export_trace_results():
+    global trace_events, trace_job_records
+
+    # Take ownership of the collected spans and records so the next processing pass starts afresh
+    with trace_lock:
+        exported_events, trace_events = trace_events, []
+        exported_job_records, trace_job_records = trace_job_records, {}
+
+    # Only export jobs that recorded a new file landing, so re-processed incomplete jobs do not repeat entries
+    landed_job_records = {job_number: job_record for job_number, job_record in exported_job_records.items()
+                          if job_record["earliest_arrival"] is not None}
+    if not landed_job_records:
+        return
+
+    # Keep the spans for the landed jobs, along with the pass-level spans (e.g. inbox scanning)
+    landed_events = [trace_event for trace_event in exported_events
+                     if "job_number" not in trace_event["args"]
+                     or trace_event["args"]["job_number"] in landed_job_records]
+
+    try:
+        # Add the spans to the rolling trace file (viewable in chrome://tracing or Perfetto)
+        previous_events = []
+        if os.path.isfile(trace_file_path):
+            try:
+                with open(trace_file_path, "r", encoding="utf-8") as trace_file:
+                    previous_events = json.load(trace_file).get("traceEvents", [])
+
+            except (ValueError, AttributeError):
+                print(f"Warning: Existing Trace File Could Not Be Read. Starting A New Trace File.")
+
+        # Discard the oldest spans once the trace file reaches its event limit
+        trace_file_events = (previous_events + landed_events)[-trace_file_event_limit:]
+        with open(trace_file_path, "w", encoding="utf-8") as trace_file:
+            json.dump({"traceEvents": trace_file_events, "displayTimeUnit": "ms"}, trace_file, default=str)
+
+        # Append one latency summary line per job to keep a history across processing passes
+        with open(latency_summary_file_path, "a", encoding="utf-8") as summary_file:
+            for job_number, job_record in landed_job_records.items():
+                stage_seconds = {name: round(seconds, 3) for name, seconds in job_record["stages"].items()}
+                slowest_stage = max(stage_seconds, key=stage_seconds.get) if stage_seconds else None
+
+                # Calculate the time from the first provider email arrival to the last file landing
+                arrival_to_landing_seconds = None
+                if job_record["earliest_arrival"] is not None and job_record["latest_landing"] is not None:
+                    arrival_to_landing_seconds = round(
+                        (job_record["latest_landing"] - job_record["earliest_arrival"]).total_seconds(), 3)
+
+                # Round the slowest file operation duration to match the other summary durations
+                slowest_io = job_record["slowest_io"]
+                if slowest_io is not None:
+                    slowest_io = dict(slowest_io, seconds=round(slowest_io["seconds"], 3))
+
+                latency_summary = {
+                    "job_number": job_number,
+                    "recorded_at": datetime.datetime.now(pytz.timezone('Australia/Melbourne')).isoformat(),
+                    "arrival_to_landing_seconds": arrival_to_landing_seconds,
+                    "processing_seconds": round(sum(job_record["stages"].values()), 3),
+                    "slowest_stage": slowest_stage,
+                    "stages": stage_seconds,
+                    "slowest_io": slowest_io,
+                    "providers": {
+                        provider_name: {key: round(value, 3) if isinstance(value, float) else value
+                                        for key, value in provider_record.items()}
+                        for provider_name, provider_record in job_record["providers"].items()
+                    },
+                }
+                summary_file.write(json.dumps(latency_summary, default=str) + "\n")
+
+                print(f"Job {job_number} Latency: {arrival_to_landing_seconds} Seconds From Arrival to Landing. "
+                      f"Slowest Stage: {slowest_stage}.")
+
+    except OSError:
+        print(f"Warning: Failed to Export Trace Results.")
+        return
+
+
 # Define a main function to run the other functions for each job_number
 def main():
     # Check for an active internet connection before proceeding with processing
@@ -598,7 +846,8 @@ def main():
         inbox = target_inbox_folder
 
         # Step 2: Retrieve BYDA job numbers from the user-selected Outlook inbox folder
-        job_numbers, scanning_time_criteria = retrieve_job_information(inbox)
+        with trace_span("retrieve_job_information"):
+            job_numbers, scanning_time_criteria = retrieve_job_information(inbox)
 
         # Initialize the processed jobs set
         processed_jobs, job_count = initialize_config_file()
@@ -613,29 +862,40 @@ def main():
                     continue
 
                 # Step 3: Create BYDA job subdirectories and copy email message files into designated subdirectories
-                byda_job_location = initialize_byda_job(job_number, target_directory, scanning_time_criteria,
-                                                        inbox)
+                with trace_span("initialize_byda_job", job_number):
+                    byda_job_location = initialize_byda_job(job_number, target_directory, scanning_time_criteria,
+                                                            inbox)
 
                 # Step 4: Make a copy of the provider email message files and move them into their subdirectories
-                copy_message_files(job_number, byda_job_location, outlook, scanning_time_criteria, inbox)
+                with trace_span("copy_message_files", job_number):
+                    copy_message_files(job_number, byda_job_location, outlook, scanning_time_criteria, inbox)
 
                 # Step 5: Extract the attachments from the provider email messages and move them
-                kdr_indicator = extract_message_files(job_number, byda_job_location, scanning_time_criteria, inbox)
+                with trace_span("extract_message_files", job_number):
+                    kdr_indicator = extract_message_files(job_number, byda_job_location, scanning_time_criteria,
+                                                          inbox)
 
                 # Step 6: Identify the job coversheet file
-                initialize_coversheet(job_number, byda_job_location)
+                with trace_span("initialize_coversheet", job_number):
+                    initialize_coversheet(job_number, byda_job_location)
 
                 # Step 7: Scan the job coversheet to identify if any provider plans are missing
-                coversheet_output_text, provider_subdirectory_names = scan_coversheet(job_number,
-                                                                                      byda_job_location)
+                with trace_span("scan_coversheet", job_number):
+                    coversheet_output_text, provider_subdirectory_names = scan_coversheet(job_number,
+                                                                                          byda_job_location)
 
                 # Step 8: Display the scan_coversheet function results to the user
-                byda_job_complete = return_coversheet_results(byda_job_location, kdr_indicator,
-                                                              coversheet_output_text,
-                                                              provider_subdirectory_names, job_number)
+                with trace_span("return_coversheet_results", job_number):
+                    byda_job_complete = return_coversheet_results(byda_job_location, kdr_indicator,
+                                                                  coversheet_output_text,
+                                                                  provider_subdirectory_names, job_number)
 
                 # Step 9: Create and/or initialize the program configuration file to track key statistics
-                update_config_file(job_number, byda_job_complete)
+                with trace_span("update_config_file", job_number):
+                    update_config_file(job_number, byda_job_complete)
+
+        # Export the trace spans and per-job latency summaries for this processing pass
+        export_trace_results()
 
         if system_tray_icon_status:
             print(f"Important: All Current Jobs Have Been Identified/Sorted. Attempting Processing Again In "